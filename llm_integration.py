@@ -3,16 +3,105 @@ LLM Integration Module for Obsidian to Anki
 Provides LLM-powered flashcard generation and answer generation
 """
 
+import asyncio
+import copy
+import functools
+import gzip
+import hashlib
 import json
+import random
+import re
 import requests
+import threading
 import time
-from typing import List, Dict, Optional, Any
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from dataclasses import dataclass, fields
+from requests.adapters import HTTPAdapter
+from typing import List, Dict, Optional, Any, Tuple, Iterable, Iterator, Callable, Sequence, Union
 from abc import ABC, abstractmethod
 from enum import Enum
 
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional speedup
+    orjson = None
 
-class LLMErrorType(Enum):
-    """Types of LLM errors"""
+try:
+    import aiohttp
+except ImportError:  # pragma: no cover - optional async transport
+    aiohttp = None
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover - optional speedup
+    numpy = None
+
+
+# Fenced code blocks wrapping the JSON in card responses
+_JSON_BLOCK_RE = re.compile(r'```json\s*(.*?)\s*```', re.DOTALL)
+# Any other fence; the info string (e.g. "JSON", "javascript") is skipped
+_FENCED_BLOCK_RE = re.compile(r'```[\w+.-]*[ \t]*\n?\s*(.*?)\s*```', re.DOTALL)
+
+
+# Noise stripped from note text before semantic cache lookups
+_WIKI_LINK_RE = re.compile(r'!?\[\[([^\]|#]*)(?:#[^\]|]*)?(?:\|([^\]]*))?\]\]')
+_WHITESPACE_RE = re.compile(r'\s+')
+
+_EMPTY_USAGE: Dict[str, int] = {'prompt_tokens': 0, 'completion_tokens': 0, 'total_tokens': 0}
+
+
+def _usage_counts(usage: Dict[str, Any]) -> Dict[str, int]:
+    """Normalize token usage, including prompt cache counters"""
+    details = usage.get('prompt_tokens_details') or _EMPTY_USAGE
+    return {
+        'prompt_tokens': usage.get('prompt_tokens', 0),
+        'completion_tokens': usage.get('completion_tokens', 0),
+        'total_tokens': usage.get('total_tokens', 0),
+        'cache_read_input_tokens': usage.get('cache_read_input_tokens') or details.get('cached_tokens', 0),
+        'cache_creation_input_tokens': usage.get('cache_creation_input_tokens', 0),
+    }
+
+
+def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parse a Retry-After header (delay in seconds or HTTP-date)"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+def _json_loads(data: Any) -> Any:
+    """Parse JSON with orjson when available"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _json_dumps(data: Any) -> bytes:
+    """Serialize JSON to UTF-8 bytes with orjson when available"""
+    if orjson is not None:
+        try:
+            return orjson.dumps(data)
+        except TypeError:
+            # Non-string keys or types orjson does not handle
+            pass
+    return json.dumps(data, ensure_ascii=False).encode('utf-8')
+
+
+class LLMErrorType(str, Enum):
+    """Types of LLM errors (members also compare equal to their string values)"""
     PROVIDER_UNAVAILABLE = "provider_unavailable"
     API_ERROR = "api_error"
     TIMEOUT = "timeout"
@@ -23,14 +112,60 @@ class LLMErrorType(Enum):
     AUTHENTICATION_ERROR = "authentication_error"
 
 
+# Error types after which a provider's cached availability is stale
+_AVAILABILITY_ERRORS = (LLMErrorType.PROVIDER_UNAVAILABLE, LLMErrorType.NETWORK_ERROR)
+
+
 class LLMError(Exception):
     """LLM Error class"""
+    __slots__ = ('error_type', 'retryable', 'provider', 'retry_after')
+
     def __init__(self, message: str, error_type: LLMErrorType,
-                 retryable: bool = False, provider: Optional[str] = None):
+                 retryable: bool = False, provider: Optional[str] = None,
+                 retry_after: Optional[float] = None):
         super().__init__(message)
         self.error_type = error_type
         self.retryable = retryable
         self.provider = provider
+        # Server-requested delay in seconds before retrying, if any
+        self.retry_after = retry_after
+
+    def __reduce__(self):
+        # Slot attributes are not part of the default exception pickle state
+        return (self.__class__,
+                (str(self), self.error_type, self.retryable, self.provider, self.retry_after))
+
+
+@dataclass(frozen=True)
+class ProviderConfig:
+    """Validated, immutable provider configuration"""
+    endpoint: str
+    model: str
+    api_key: Optional[str] = None
+    temperature: float = 0.7
+    max_tokens: int = 2000
+    timeout: int = 60
+    provider: str = 'openai-compatible'
+    stream: bool = False
+    prompt_cache_key: Optional[str] = None
+    compress_requests: bool = False
+
+    @classmethod
+    def from_dict(cls, config: Dict[str, Any]) -> 'ProviderConfig':
+        """Build config from a dict, ignoring unknown keys"""
+        required = ['endpoint', 'model']
+        for key in required:
+            if config.get(key) is None:
+                raise LLMError(
+                    f"Missing required config: {key}",
+                    LLMErrorType.INVALID_CONFIG,
+                    False,
+                    config.get('provider', 'unknown')
+                )
+
+        known = {field.name for field in fields(cls)}
+        return cls(**{key: value for key, value in config.items()
+                      if key in known and value is not None})
 
 
 class LLMProvider(ABC):
@@ -56,171 +191,868 @@ class LLMProvider(ABC):
         """Get provider name"""
         pass
 
+    def stream_completion(self, messages: List[Dict[str, str]]) -> Iterator[str]:
+        """Stream completion content; providers without streaming yield it at once"""
+        yield self.generate_completion(messages)['content']
+
+    def invalidate_availability(self) -> None:
+        """Forget any cached availability result"""
+        pass
+
+    def cached_availability(self) -> Optional[bool]:
+        """Get a recent availability result without probing, or None if unknown"""
+        return None
+
+    def close(self) -> None:
+        """Release any resources held by the provider"""
+        pass
+
+    async def agenerate_completion(self, messages: List[Dict[str, str]]) -> Dict[str, Any]:
+        """Generate completion without blocking the event loop"""
+        return await asyncio.to_thread(self.generate_completion, messages)
+
+    async def ais_available(self) -> bool:
+        """Check availability without blocking the event loop"""
+        return await asyncio.to_thread(self.is_available)
+
+    async def aclose(self) -> None:
+        """Release any resources held by the provider"""
+        self.close()
+
 
 class OpenAICompatibleProvider(LLMProvider):
     """OpenAI-compatible API provider (supports Ollama, LM Studio, OpenRouter, OpenAI)"""
 
-    def __init__(self):
-        self.config = None
+    # Connection pool sizing for the shared keep-alive session
+    POOL_CONNECTIONS = 8
+    POOL_MAXSIZE = 16
+    # Seconds an is_available() result is reused before probing again
+    AVAILABILITY_TTL = 30.0
+    # Status codes from the /models probe that mean the server is up
+    AVAILABLE_STATUS_CODES = (200, 404, 405)
+    # Request bodies larger than this are gzipped when compress_requests is set
+    GZIP_THRESHOLD = 16 * 1024
 
-    def initialize(self, config: Dict[str, Any]) -> None:
+    def __init__(self):
+        self.config: Optional[ProviderConfig] = None
+        self._headers: Dict[str, str] = {}
+        self._base_payload: Dict[str, Any] = {}
+        self._avail_cache: Optional[Tuple[float, bool]] = None
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.POOL_CONNECTIONS,
+                              pool_maxsize=self.POOL_MAXSIZE,
+                              max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def initialize(self, config: Union[Dict[str, Any], ProviderConfig]) -> None:
         """Initialize provider with config"""
+        if not isinstance(config, ProviderConfig):
+            config = ProviderConfig.from_dict(config)
         self.config = config
-
-        required = ['endpoint', 'model']
-        for key in required:
-            if key not in config:
-                raise LLMError(
-                    f"Missing required config: {key}",
-                    LLMErrorType.INVALID_CONFIG,
-                    False,
-                    config.get('provider', 'unknown')
-                )
+        self._avail_cache = None
+
+        # Precompute per-request headers and payload fields once
+        self._headers = {'Content-Type': 'application/json'}
+        if config.api_key:
+            self._headers['Authorization'] = f"Bearer {config.api_key}"
+        self.session.headers.pop('Authorization', None)
+        self.session.headers.update(self._headers)
+
+        self._base_payload = {
+            'model': config.model,
+            'temperature': config.temperature,
+            'max_tokens': config.max_tokens,
+        }
+        if config.prompt_cache_key:
+            # OpenAI prompt caching hint; other providers ignore it
+            self._base_payload['prompt_cache_key'] = config.prompt_cache_key
 
     def generate_completion(self, messages: List[Dict[str, str]]) -> Dict[str, Any]:
         """Generate completion using OpenAI-compatible API"""
-        if not self.config:
-            raise LLMError(
-                "Provider not initialized",
-                LLMErrorType.INVALID_CONFIG,
-                False
-            )
+        self._check_initialized()
 
-        headers = {
-            'Content-Type': 'application/json',
-        }
+        try:
+            if self.config.stream:
+                return self._collect_stream(messages)
+            return self._complete(messages)
+        except LLMError:
+            self.invalidate_availability()
+            raise
+
+    def _complete(self, messages: List[Dict[str, str]]) -> Dict[str, Any]:
+        """Send a non-streaming completion request"""
+        try:
+            body, headers = self._encode_body(self._build_payload(messages))
+            response = self.session.post(
+                self.config.endpoint,
+                data=body,
+                headers=headers,
+                timeout=self.config.timeout
+            )
+            self._check_status(response)
+            data = _json_loads(response.content)
 
-        # Add API key if provided
-        if self.config.get('api_key'):
-            headers['Authorization'] = f"Bearer {self.config['api_key']}"
+        except requests.exceptions.RequestException as e:
+            raise self._request_error(e)
+        except ValueError as e:
+            raise LLMError(
+                f"Failed to parse response: {str(e)}",
+                LLMErrorType.PARSE_ERROR,
+                False,
+                self.config.provider
+            )
 
-        payload = {
-            'model': self.config['model'],
-            'messages': messages,
-            'temperature': self.config.get('temperature', 0.7),
-            'max_tokens': self.config.get('max_tokens', 2000),
-        }
+        return self._parse_response(data)
 
-        timeout = self.config.get('timeout', 60)
+    def stream_completion(self, messages: List[Dict[str, str]]) -> Iterator[str]:
+        """Stream completion content as it is generated"""
+        self._check_initialized()
 
         try:
-            response = requests.post(
-                self.config['endpoint'],
-                headers=headers,
-                json=payload,
-                timeout=timeout
+            for event in self._iter_stream_events(messages):
+                choices = event.get('choices')
+                if choices:
+                    content = (choices[0].get('delta') or {}).get('content')
+                    if content:
+                        yield content
+        except LLMError:
+            self.invalidate_availability()
+            raise
+
+    def _check_initialized(self) -> None:
+        """Raise if the provider has no config"""
+        if not self.config:
+            raise LLMError(
+                "Provider not initialized",
+                LLMErrorType.INVALID_CONFIG,
+                False
             )
 
-            # Handle error status codes
-            if response.status_code == 401 or response.status_code == 403:
-                raise LLMError(
-                    f"Authentication failed: {response.status_code}",
-                    LLMErrorType.AUTHENTICATION_ERROR,
-                    False,
-                    self.config.get('provider')
-                )
-            elif response.status_code == 429:
-                raise LLMError(
-                    "Rate limit exceeded",
-                    LLMErrorType.RATE_LIMIT,
-                    True,
-                    self.config.get('provider')
-                )
-            elif response.status_code >= 500:
-                raise LLMError(
-                    f"Server error: {response.status_code}",
-                    LLMErrorType.API_ERROR,
-                    True,
-                    self.config.get('provider')
-                )
-            elif response.status_code != 200:
-                raise LLMError(
-                    f"API error: {response.status_code} - {response.text}",
-                    LLMErrorType.API_ERROR,
-                    False,
-                    self.config.get('provider')
-                )
+    def _build_payload(self, messages: List[Dict[str, str]], stream: bool = False) -> Dict[str, Any]:
+        """Build request payload"""
+        payload = {**self._base_payload, 'messages': messages}
+        if stream:
+            payload['stream'] = True
+        return payload
 
-            data = response.json()
-            return self._parse_response(data)
+    def _encode_body(self, payload: Dict[str, Any]) -> Tuple[bytes, Optional[Dict[str, str]]]:
+        """Serialize the payload, gzipping large bodies when enabled
 
-        except requests.exceptions.Timeout:
-            raise LLMError(
+        Returns the body and any extra headers it needs.
+        """
+        body = _json_dumps(payload)
+        if self.config.compress_requests and len(body) > self.GZIP_THRESHOLD:
+            try:
+                return gzip.compress(body, compresslevel=1), {'Content-Encoding': 'gzip'}
+            except (OSError, ValueError):
+                pass
+        return body, None
+
+    def _check_status(self, response: requests.Response) -> None:
+        """Raise LLMError for error status codes"""
+        if response.status_code != 200:
+            raise self._status_error(response.status_code, response.headers, response.text)
+
+    def _status_error(self, status_code: int, headers: Any, text: str) -> LLMError:
+        """Build LLMError for a non-200 status code"""
+        if status_code == 401 or status_code == 403:
+            return LLMError(
+                f"Authentication failed: {status_code}",
+                LLMErrorType.AUTHENTICATION_ERROR,
+                False,
+                self.config.provider
+            )
+        elif status_code == 429:
+            return LLMError(
+                "Rate limit exceeded",
+                LLMErrorType.RATE_LIMIT,
+                True,
+                self.config.provider,
+                _parse_retry_after(headers.get('Retry-After'))
+            )
+        elif status_code >= 500:
+            return LLMError(
+                f"Server error: {status_code}",
+                LLMErrorType.API_ERROR,
+                True,
+                self.config.provider
+            )
+        return LLMError(
+            f"API error: {status_code} - {text}",
+            LLMErrorType.API_ERROR,
+            False,
+            self.config.provider
+        )
+
+    def _request_error(self, error: requests.exceptions.RequestException) -> LLMError:
+        """Convert a requests exception to LLMError"""
+        if isinstance(error, requests.exceptions.Timeout):
+            return LLMError(
                 "Request timeout",
                 LLMErrorType.TIMEOUT,
                 True,
-                self.config.get('provider')
+                self.config.provider
             )
+        return LLMError(
+            f"Network error: {str(error)}",
+            LLMErrorType.NETWORK_ERROR,
+            True,
+            self.config.provider
+        )
+
+    def _iter_stream_events(self, messages: List[Dict[str, str]]) -> Iterator[Dict[str, Any]]:
+        """Yield parsed server-sent event chunks from a streaming completion"""
+        body, headers = self._encode_body(self._build_payload(messages, stream=True))
+        try:
+            with self.session.post(
+                self.config.endpoint,
+                data=body,
+                headers=headers,
+                timeout=self.config.timeout,
+                stream=True
+            ) as response:
+                self._check_status(response)
+
+                for line in response.iter_lines():
+                    if not line.startswith(b'data:'):
+                        continue
+                    data = line[5:].strip()
+                    if data == b'[DONE]':
+                        break
+                    try:
+                        yield _json_loads(data)
+                    except ValueError as e:
+                        raise LLMError(
+                            f"Failed to parse stream chunk: {str(e)}",
+                            LLMErrorType.PARSE_ERROR,
+                            False,
+                            self.config.provider
+                        )
+
         except requests.exceptions.RequestException as e:
-            raise LLMError(
-                f"Network error: {str(e)}",
-                LLMErrorType.NETWORK_ERROR,
-                True,
-                self.config.get('provider')
-            )
+            raise self._request_error(e)
+
+    def _collect_stream(self, messages: List[Dict[str, str]]) -> Dict[str, Any]:
+        """Consume a streaming completion into a regular response"""
+        parts = []
+        finish_reason = 'stop'
+        model = self.config.model
+        usage = None
+
+        for event in self._iter_stream_events(messages):
+            model = event.get('model', model)
+            if event.get('usage'):
+                usage = event['usage']
+            choices = event.get('choices')
+            if choices:
+                choice = choices[0]
+                content = (choice.get('delta') or {}).get('content')
+                if content:
+                    parts.append(content)
+                if choice.get('finish_reason'):
+                    finish_reason = choice['finish_reason']
+
+        usage = usage or _EMPTY_USAGE
+        return {
+            'content': ''.join(parts),
+            'usage': _usage_counts(usage),
+            'model': model,
+            'finish_reason': finish_reason
+        }
 
     def is_available(self) -> bool:
-        """Check if provider is available"""
-        if not self.config or 'endpoint' not in self.config:
+        """Check if provider is available, reusing recent results"""
+        if not self.config:
             return False
 
+        cached = self._avail_cache
+        if cached is not None and time.monotonic() - cached[0] < self.AVAILABILITY_TTL:
+            return cached[1]
+
+        available = self._probe_availability()
+        self._avail_cache = (time.monotonic(), available)
+        return available
+
+    def invalidate_availability(self) -> None:
+        """Forget the cached availability result"""
+        self._avail_cache = None
+
+    def cached_availability(self) -> Optional[bool]:
+        """Get a recent availability result without probing, or None if unknown"""
+        cached = self._avail_cache
+        if cached is not None and time.monotonic() - cached[0] < self.AVAILABILITY_TTL:
+            return cached[1]
+        return None
+
+    def _probe_availability(self) -> bool:
+        """Probe the endpoint over HTTP without downloading the model list"""
         try:
             # Try to reach the endpoint
-            test_endpoint = self.config['endpoint'].replace('/chat/completions', '/models')
+            test_endpoint = self.config.endpoint.replace('/chat/completions', '/models')
 
-            headers = {}
-            if self.config.get('api_key'):
-                headers['Authorization'] = f"Bearer {self.config['api_key']}"
+            response = self.session.head(test_endpoint, timeout=5, allow_redirects=True)
+            if response.status_code in self.AVAILABLE_STATUS_CODES:
+                return True
 
-            response = requests.get(test_endpoint, headers=headers, timeout=5)
-            return response.status_code in [200, 404, 405]
+            # Some servers reject HEAD; fall back to GET but never read the body
+            with self.session.get(test_endpoint, timeout=5, stream=True) as response:
+                return response.status_code in self.AVAILABLE_STATUS_CODES
 
         except Exception:
             return False
 
     def get_name(self) -> str:
         """Get provider name"""
-        return self.config.get('provider', 'openai-compatible') if self.config else 'unknown'
+        return self.config.provider if self.config else 'unknown'
+
+    def close(self) -> None:
+        """Close the underlying HTTP session"""
+        self.session.close()
 
     def _parse_response(self, data: Dict[str, Any]) -> Dict[str, Any]:
         """Parse API response"""
         try:
-            if 'choices' not in data or not data['choices']:
+            choices = data.get('choices')
+            if not choices:
                 raise ValueError("Invalid response format: missing choices")
 
-            choice = data['choices'][0]
-            if 'message' not in choice:
+            choice = choices[0]
+            message = choice.get('message')
+            if message is None:
                 raise ValueError("Invalid response format: missing message")
 
+            usage = data.get('usage') or _EMPTY_USAGE
             return {
-                'content': choice['message']['content'],
-                'usage': {
-                    'prompt_tokens': data.get('usage', {}).get('prompt_tokens', 0),
-                    'completion_tokens': data.get('usage', {}).get('completion_tokens', 0),
-                    'total_tokens': data.get('usage', {}).get('total_tokens', 0),
-                },
-                'model': data.get('model', self.config['model']),
-                'finish_reason': choice.get('finish_reason', 'stop')
+                'content': message['content'],
+                'usage': _usage_counts(usage),
+                'model': data.get('model') or self.config.model,
+                'finish_reason': choice.get('finish_reason') or 'stop'
             }
 
-        except (KeyError, ValueError, IndexError) as e:
+        except (KeyError, ValueError, IndexError, TypeError, AttributeError) as e:
             raise LLMError(
                 f"Failed to parse response: {str(e)}",
                 LLMErrorType.PARSE_ERROR,
                 False,
-                self.config.get('provider')
+                self.config.provider
             )
 
 
+class AsyncOpenAICompatibleProvider(OpenAICompatibleProvider):
+    """OpenAI-compatible provider with an aiohttp transport for async fan-out
+
+    The synchronous methods from OpenAICompatibleProvider keep working.
+    """
+
+    # aiohttp connection pool limits
+    CONNECTOR_LIMIT = 32
+    CONNECTOR_LIMIT_PER_HOST = 16
+    KEEPALIVE_TIMEOUT = 75
+
+    def __init__(self):
+        super().__init__()
+        self._client = None
+        self._client_loop = None
+
+    def initialize(self, config: Union[Dict[str, Any], ProviderConfig]) -> None:
+        """Initialize provider with config"""
+        if aiohttp is None:
+            raise LLMError(
+                "aiohttp is required for async providers",
+                LLMErrorType.INVALID_CONFIG,
+                False
+            )
+        super().initialize(config)
+
+    async def agenerate_completion(self, messages: List[Dict[str, str]]) -> Dict[str, Any]:
+        """Generate completion using OpenAI-compatible API"""
+        self._check_initialized()
+
+        try:
+            client = await self._get_client()
+            timeout = aiohttp.ClientTimeout(total=self.config.timeout)
+            body, headers = self._encode_body(self._build_payload(messages))
+            async with client.post(self.config.endpoint,
+                                   data=body,
+                                   headers=headers,
+                                   timeout=timeout) as response:
+                if response.status != 200:
+                    raise self._status_error(response.status, response.headers, await response.text())
+                body = await response.read()
+
+            data = _json_loads(body)
+
+        except LLMError:
+            self.invalidate_availability()
+            raise
+        except asyncio.TimeoutError:
+            self.invalidate_availability()
+            raise LLMError(
+                "Request timeout",
+                LLMErrorType.TIMEOUT,
+                True,
+                self.config.provider
+            )
+        except aiohttp.ClientError as e:
+            self.invalidate_availability()
+            raise LLMError(
+                f"Network error: {str(e)}",
+                LLMErrorType.NETWORK_ERROR,
+                True,
+                self.config.provider
+            )
+        except ValueError as e:
+            raise LLMError(
+                f"Failed to parse response: {str(e)}",
+                LLMErrorType.PARSE_ERROR,
+                False,
+                self.config.provider
+            )
+
+        return self._parse_response(data)
+
+    async def ais_available(self) -> bool:
+        """Check if provider is available, reusing recent results"""
+        if not self.config:
+            return False
+
+        cached = self._avail_cache
+        if cached is not None and time.monotonic() - cached[0] < self.AVAILABILITY_TTL:
+            return cached[1]
+
+        try:
+            test_endpoint = self.config.endpoint.replace('/chat/completions', '/models')
+            timeout = aiohttp.ClientTimeout(total=5)
+            client = await self._get_client()
+            async with client.head(test_endpoint, timeout=timeout, allow_redirects=True) as response:
+                available = response.status in self.AVAILABLE_STATUS_CODES
+            if not available:
+                # Some servers reject HEAD; fall back to GET but never read the body
+                async with client.get(test_endpoint, timeout=timeout) as response:
+                    available = response.status in self.AVAILABLE_STATUS_CODES
+        except Exception:
+            available = False
+
+        self._avail_cache = (time.monotonic(), available)
+        return available
+
+    def close(self) -> None:
+        """Close the HTTP sessions
+
+        An aiohttp session can only be closed from an event loop, so this
+        only succeeds when no loop is running; async callers should
+        ``await aclose()`` instead.
+        """
+        client, loop = self._client, self._client_loop
+        if client is not None and not client.closed:
+            try:
+                asyncio.get_running_loop()
+                running = True
+            except RuntimeError:
+                running = loop is not None and loop.is_running()
+            if running:
+                print("Warning: aiohttp session left open; use 'await aclose()' from async code")
+                super().close()
+                return
+            if loop is not None and not loop.is_closed():
+                loop.run_until_complete(client.close())
+            else:
+                asyncio.run(client.close())
+        self._client = None
+        self._client_loop = None
+        super().close()
+
+    async def aclose(self) -> None:
+        """Close the HTTP sessions"""
+        if self._client is not None and not self._client.closed:
+            await self._client.close()
+        self._client = None
+        self._client_loop = None
+        super().close()
+
+    async def _get_client(self) -> "aiohttp.ClientSession":
+        """Get the aiohttp session, creating it on the running event loop
+
+        A session left over from a finished loop (e.g. a previous
+        ``asyncio.run``) is closed before a new one is created; a session
+        still owned by another live loop cannot be shared.
+        """
+        loop = asyncio.get_running_loop()
+        client = self._client
+        if client is not None and not client.closed and self._client_loop is not loop:
+            if not self._client_loop.is_closed():
+                raise LLMError(
+                    "aiohttp session is bound to another event loop; call aclose() first",
+                    LLMErrorType.INVALID_CONFIG,
+                    False,
+                    self.config.provider
+                )
+            await client.close()
+        if client is None or client.closed or self._client_loop is not loop:
+            connector = aiohttp.TCPConnector(
+                limit=self.CONNECTOR_LIMIT,
+                limit_per_host=self.CONNECTOR_LIMIT_PER_HOST,
+                keepalive_timeout=self.KEEPALIVE_TIMEOUT
+            )
+            self._client = aiohttp.ClientSession(connector=connector,
+                                                 headers=self._headers)
+            self._client_loop = loop
+        return self._client
+
+
+class ResponseCache:
+    """In-memory TTL/LRU cache for completion responses"""
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 3600,
+                 max_temperature: float = 0.3):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # Sampled (high temperature) completions are not worth replaying
+        self.max_temperature = max_temperature
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(config: ProviderConfig, messages: List[Dict[str, Any]]) -> str:
+        """Build a cache key from the model, messages and sampling params"""
+        raw = json.dumps({
+            'model': config.model,
+            'messages': messages,
+            'temperature': config.temperature,
+            'max_tokens': config.max_tokens,
+        }, sort_keys=True)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def is_cacheable(self, config: ProviderConfig) -> bool:
+        """Check if responses for this config may be cached"""
+        return config.temperature <= self.max_temperature
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Get a copy of a cached response, or None on miss/expiry"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if time.monotonic() - entry[0] < self.ttl:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return copy.deepcopy(entry[1])
+                del self._entries[key]
+                self.evictions += 1
+            self.misses += 1
+            return None
+
+    def set(self, key: str, response: Dict[str, Any]) -> None:
+        """Store a copy of a response"""
+        response = copy.deepcopy(response)
+        with self._lock:
+            self._entries[key] = (time.monotonic(), response)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def lookup(self, config: ProviderConfig,
+               messages: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """Get the cached response for a request"""
+        return self.get(self.make_key(config, messages))
+
+    def store(self, config: ProviderConfig, messages: List[Dict[str, Any]],
+              response: Dict[str, Any]) -> None:
+        """Cache the response for a request"""
+        self.set(self.make_key(config, messages), response)
+
+    def discard(self, config: ProviderConfig, messages: List[Dict[str, Any]],
+                response: Optional[Dict[str, Any]] = None) -> None:
+        """Drop the cached response for a request, e.g. once it proved unusable"""
+        with self._lock:
+            self._entries.pop(self.make_key(config, messages), None)
+
+    def clear(self) -> None:
+        """Drop all cached responses"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """Get hit/miss/eviction counters"""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'size': len(self._entries),
+            }
+
+
+class SemanticResponseCache(ResponseCache):
+    """Response cache that also matches near-duplicate prompts
+
+    On an exact miss, the user content is normalized (case, whitespace,
+    wiki-link syntax) and embedded, and the most similar recent entry for
+    the same model, parameters and system prompt is returned if its cosine
+    similarity reaches the threshold.
+
+    embed is any callable mapping text to a vector; by default a
+    sentence-transformers model is loaded on first use. If system_prompts
+    is given, near-duplicate matching only applies to requests whose sole
+    non-user message is one of them; other requests match exactly.
+    """
+
+    DEFAULT_MODEL = 'all-MiniLM-L6-v2'
+    # Recent embeddings kept so a miss is not embedded again on store
+    EMBED_MEMO_SIZE = 64
+
+    def __init__(self, embed: Optional[Callable[[str], Sequence[float]]] = None,
+                 threshold: float = 0.97, max_entries: int = 1024,
+                 system_prompts: Optional[Sequence[Dict[str, Any]]] = None, **kwargs):
+        super().__init__(**kwargs)
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.system_prompts = system_prompts
+        self.semantic_hits = 0
+        self._embed = embed
+        self._vectors: Dict[str, deque] = {}
+        self._embedded: "OrderedDict[str, List[float]]" = OrderedDict()
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        """Strip formatting noise that does not change the extracted cards"""
+        text = _WIKI_LINK_RE.sub(lambda m: m.group(2) or m.group(1), text)
+        return _WHITESPACE_RE.sub(' ', text.lower()).strip()
+
+    def lookup(self, config: ProviderConfig,
+               messages: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """Get the cached response for an identical or near-identical request"""
+        response = super().lookup(config, messages)
+        if response is not None or not self._is_semantic(messages):
+            return response
+
+        scope, text = self._split(config, messages)
+        with self._lock:
+            entries = list(self._vectors.get(scope, ()))
+        if not entries:
+            return None
+
+        vector = self._embed_text(text)
+        now = time.monotonic()
+        entries = [entry for entry in entries if now - entry[0] < self.ttl]
+        if not entries:
+            return None
+
+        if numpy is not None:
+            scores = numpy.asarray([entry[1] for entry in entries]).dot(numpy.asarray(vector))
+            best = int(scores.argmax())
+            score = float(scores[best])
+        else:
+            score, best = max(
+                (sum(a * b for a, b in zip(entry[1], vector)), i)
+                for i, entry in enumerate(entries)
+            )
+
+        if score < self.threshold:
+            return None
+
+        with self._lock:
+            self.semantic_hits += 1
+            self.hits += 1
+            self.misses -= 1
+        return copy.deepcopy(entries[best][2])
+
+    def store(self, config: ProviderConfig, messages: List[Dict[str, Any]],
+              response: Dict[str, Any]) -> None:
+        """Cache the response under its exact key and its embedding"""
+        super().store(config, messages, response)
+        if not self._is_semantic(messages):
+            return
+
+        scope, text = self._split(config, messages)
+        vector = self._embed_text(text)
+        with self._lock:
+            if scope not in self._vectors:
+                self._vectors[scope] = deque(maxlen=self.max_entries)
+            self._vectors[scope].append((time.monotonic(), vector, copy.deepcopy(response)))
+
+    def discard(self, config: ProviderConfig, messages: List[Dict[str, Any]],
+                response: Optional[Dict[str, Any]] = None) -> None:
+        """Drop the cached response for a request and near-duplicates returning it"""
+        super().discard(config, messages)
+        if response is None or not self._is_semantic(messages):
+            return
+
+        scope, _ = self._split(config, messages)
+        with self._lock:
+            entries = self._vectors.get(scope)
+            if entries:
+                kept = [entry for entry in entries if entry[2] != response]
+                entries.clear()
+                entries.extend(kept)
+
+    def clear(self) -> None:
+        """Drop all cached responses"""
+        super().clear()
+        with self._lock:
+            self._vectors.clear()
+            self._embedded.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """Get hit/miss/eviction counters"""
+        stats = super().stats()
+        stats['semantic_hits'] = self.semantic_hits
+        return stats
+
+    def _is_semantic(self, messages: List[Dict[str, Any]]) -> bool:
+        """Check if a request may be answered by a near-duplicate"""
+        if self.system_prompts is None:
+            return True
+        fixed = [m for m in messages if m.get('role') != 'user']
+        return len(fixed) == 1 and fixed[0] in self.system_prompts
+
+    def _split(self, config: ProviderConfig,
+               messages: List[Dict[str, Any]]) -> Tuple[str, str]:
+        """Split a request into an exact-match scope and the user text to embed"""
+        fixed = [m for m in messages if m.get('role') != 'user']
+        parts = []
+        for message in messages:
+            if message.get('role') != 'user':
+                continue
+            content = message.get('content')
+            if isinstance(content, list):
+                parts.extend(part.get('text', '') for part in content if isinstance(part, dict))
+            else:
+                parts.append(str(content))
+        return self.make_key(config, fixed), self.normalize('\n'.join(parts))
+
+    def _embed_text(self, text: str) -> List[float]:
+        """Embed text as a unit vector, reusing recent results"""
+        with self._lock:
+            vector = self._embedded.get(text)
+            if vector is not None:
+                self._embedded.move_to_end(text)
+                return vector
+
+        if self._embed is None:
+            self._embed = self._load_default_embedder()
+        vector = [float(x) for x in self._embed(text)]
+        norm = sum(x * x for x in vector) ** 0.5
+        if norm:
+            vector = [x / norm for x in vector]
+
+        with self._lock:
+            self._embedded[text] = vector
+            while len(self._embedded) > self.EMBED_MEMO_SIZE:
+                self._embedded.popitem(last=False)
+        return vector
+
+    def _load_default_embedder(self) -> Callable[[str], Sequence[float]]:
+        """Load the default sentence-transformers model"""
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError:
+            raise LLMError(
+                "Semantic cache requires sentence-transformers or a custom embed function",
+                LLMErrorType.INVALID_CONFIG,
+                False
+            )
+        model = SentenceTransformer(self.DEFAULT_MODEL)
+        return model.encode
+
+
+class CircuitState(Enum):
+    """Circuit breaker states"""
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """Fail fast on a provider after repeated failures
+
+    After threshold consecutive failures the circuit opens and calls are
+    rejected for cooldown seconds; then a single trial call is let through
+    (half-open) and its outcome closes or re-opens the circuit. A trial
+    that reports no outcome within cooldown seconds is replaced by a new one.
+    """
+
+    # Errors that say the endpoint itself is unhealthy; API_ERROR only
+    # counts when retryable (5xx), since a 4xx is the request's fault
+    TRIP_ERRORS = (
+        LLMErrorType.PROVIDER_UNAVAILABLE,
+        LLMErrorType.TIMEOUT,
+        LLMErrorType.NETWORK_ERROR,
+    )
+
+    def __init__(self, threshold: int = 5, cooldown: float = 30.0):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.state = CircuitState.CLOSED
+        self.failure_count = 0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """Check if a call may go through"""
+        with self._lock:
+            if self.state == CircuitState.CLOSED:
+                return True
+            now = time.monotonic()
+            if now - self.opened_at >= self.cooldown:
+                # Open past cooldown, or a half-open trial that never reported back
+                self.state = CircuitState.HALF_OPEN
+                self.opened_at = now
+                return True
+            return False
+
+    def record_failure(self) -> None:
+        """Record a failed call"""
+        with self._lock:
+            self.failure_count += 1
+            if self.state == CircuitState.HALF_OPEN or self.failure_count >= self.threshold:
+                self.state = CircuitState.OPEN
+                self.opened_at = time.monotonic()
+
+    def record_error(self, error: LLMError) -> None:
+        """Record a call that raised LLMError"""
+        if error.error_type in self.TRIP_ERRORS or (
+                error.error_type == LLMErrorType.API_ERROR and error.retryable):
+            self.record_failure()
+        else:
+            # The endpoint answered, so it is healthy
+            self.reset()
+
+    def reset(self) -> None:
+        """Record a successful call"""
+        with self._lock:
+            self.state = CircuitState.CLOSED
+            self.failure_count = 0
+
+    def release(self) -> None:
+        """Record a call abandoned without an outcome, freeing a half-open trial"""
+        with self._lock:
+            if self.state == CircuitState.HALF_OPEN:
+                self.state = CircuitState.OPEN
+                self.opened_at = time.monotonic() - self.cooldown
+
+
 class LLMRouter:
     """Routes requests to appropriate LLM providers with fallback"""
 
-    def __init__(self):
+    def __init__(self, cache: Optional[ResponseCache] = None):
+        self.cache = cache
         self.providers: Dict[str, LLMProvider] = {}
         self.default_provider: Optional[str] = None
         self.fallback_providers: List[str] = []
         self.retry_attempts = 3
         self.retry_delay = 1.0  # seconds
+        self.max_retry_delay = 60.0  # seconds
+        self.breaker_threshold = 5
+        self.breaker_cooldown = 30.0  # seconds
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        # Identical requests currently being generated, keyed by request hash
+        self._inflight: Dict[str, Future] = {}
+        self._inflight_lock = threading.Lock()
 
     def register_provider(self, name: str, provider: LLMProvider) -> None:
         """Register a new provider"""
@@ -253,71 +1085,379 @@ class LLMRouter:
         self.retry_attempts = attempts
         self.retry_delay = delay
 
+    def set_circuit_breaker_config(self, threshold: int, cooldown: float) -> None:
+        """Set circuit breaker configuration for providers"""
+        self.breaker_threshold = threshold
+        self.breaker_cooldown = cooldown
+        self.breakers.clear()
+
     def generate(self, messages: List[Dict[str, str]],
                  preferred_provider: Optional[str] = None) -> Dict[str, Any]:
-        """Generate completion using provider chain"""
-        provider_chain = self._build_provider_chain(preferred_provider)
+        """Generate completion using provider chain
 
-        if not provider_chain:
-            raise LLMError(
-                "No LLM providers available",
-                LLMErrorType.PROVIDER_UNAVAILABLE,
-                False
-            )
+        Concurrent calls with an identical request share a single upstream call.
+        """
+        key = self._request_key(messages, preferred_provider)
+        if key is None:
+            return self._generate(messages, preferred_provider)
+
+        with self._inflight_lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._inflight[key] = future
+
+        if not leader:
+            # Each caller gets its own copy of the shared response
+            return copy.deepcopy(future.result())
+
+        try:
+            response = self._generate(messages, preferred_provider)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            # Followers copy from a snapshot the leader's caller cannot mutate
+            future.set_result(copy.deepcopy(response))
+            return response
+        finally:
+            with self._inflight_lock:
+                self._inflight.pop(key, None)
+
+    def _generate(self, messages: List[Dict[str, str]],
+                  preferred_provider: Optional[str] = None) -> Dict[str, Any]:
+        """Generate completion using provider chain"""
+        chain = self._provider_chain(preferred_provider)
+        cache_config = self._cache_config(chain)
+        if cache_config:
+            cached = self.cache.lookup(cache_config, messages)
+            if cached is not None:
+                return cached
 
         last_error = None
 
         # Try each provider in the chain
-        for provider_name in provider_chain:
-            provider = self.providers.get(provider_name)
-            if not provider:
+        for provider_name, provider in chain:
+            breaker = self._get_breaker(provider_name)
+            if not self._admit(provider_name, breaker):
+                last_error = self._circuit_open_error(provider_name)
                 continue
 
-            print(f"Trying LLM provider: {provider_name}")
-
             try:
                 # Check availability
                 if not provider.is_available():
-                    print(f"Provider {provider_name} is not available, skipping")
-                    last_error = LLMError(
-                        f"Provider {provider_name} is not available",
-                        LLMErrorType.PROVIDER_UNAVAILABLE,
-                        True,
-                        provider_name
-                    )
+                    last_error = self._unavailable_error(provider_name, breaker)
                     continue
 
                 # Try to generate with retries
                 response = self._generate_with_retry(provider, messages)
-                print(f"Successfully generated completion with {provider_name}")
-                return response
 
-            except LLMError as e:
-                last_error = e
-                print(f"Provider {provider_name} failed: {str(e)}")
+            except Exception as e:
+                last_error = self._record_failure(provider_name, breaker, e)
+                continue
+            except BaseException:
+                # Interrupted or cancelled: no verdict on the provider
+                breaker.release()
+                raise
+
+            self._record_success(provider_name, breaker)
+            self._store_response(cache_config, provider, messages, response)
+            return response
+
+        raise self._chain_failed_error(last_error)
+
+    def generate_hedged(self, messages: List[Dict[str, str]],
+                        preferred_provider: Optional[str] = None,
+                        delay_ms: int = 500) -> Dict[str, Any]:
+        """Generate completion by racing the provider chain
+
+        The first provider starts immediately; the next one starts after
+        delay_ms without a response, or as soon as a running request fails.
+        The first successful response wins and slower requests are left to
+        finish in the background, still reporting to their circuit breakers.
+        Providers recently found unavailable are skipped without probing.
+        """
+        chain = self._provider_chain(preferred_provider)
+        cache_config = self._cache_config(chain)
+        if cache_config:
+            cached = self.cache.lookup(cache_config, messages)
+            if cached is not None:
+                return cached
+
+        chain = [
+            (name, provider) for name, provider in chain
+            if provider.cached_availability() is not False
+        ]
 
-                if not e.retryable:
+        executor = ThreadPoolExecutor(max_workers=max(1, len(chain)))
+        pending = {}
+        last_error = None
+        next_index = 0
+
+        try:
+            while True:
+                while next_index < len(chain):
+                    provider_name, provider = chain[next_index]
+                    next_index += 1
+                    breaker = self._get_breaker(provider_name)
+                    if not self._admit(provider_name, breaker):
+                        last_error = self._circuit_open_error(provider_name)
+                        continue
+                    future = executor.submit(self._generate_with_retry, provider, messages)
+                    pending[future] = (provider_name, provider, breaker)
+                    break
+
+                if not pending:
+                    break
+
+                timeout = delay_ms / 1000.0 if next_index < len(chain) else None
+                done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    provider_name, provider, breaker = pending.pop(future)
+                    try:
+                        response = future.result()
+                    except Exception as e:
+                        last_error = self._record_failure(provider_name, breaker, e)
+                        continue
+
+                    self._record_success(provider_name, breaker)
+                    self._store_response(cache_config, provider, messages, response)
+                    return response
+
+        finally:
+            # Requests that lost the race still report to their breakers
+            for future, (provider_name, _, breaker) in pending.items():
+                future.add_done_callback(
+                    functools.partial(self._record_background_outcome, provider_name, breaker)
+                )
+            executor.shutdown(wait=False)
+
+        raise self._chain_failed_error(last_error)
+
+    async def agenerate(self, messages: List[Dict[str, str]],
+                        preferred_provider: Optional[str] = None) -> Dict[str, Any]:
+        """Async variant of generate"""
+        chain = self._provider_chain(preferred_provider)
+        cache_config = self._cache_config(chain)
+        if cache_config:
+            cached = self.cache.lookup(cache_config, messages)
+            if cached is not None:
+                return cached
+
+        last_error = None
+
+        for provider_name, provider in chain:
+            breaker = self._get_breaker(provider_name)
+            if not self._admit(provider_name, breaker):
+                last_error = self._circuit_open_error(provider_name)
+                continue
+
+            try:
+                if not await provider.ais_available():
+                    last_error = self._unavailable_error(provider_name, breaker)
                     continue
 
+                response = await self._agenerate_with_retry(provider, messages)
+
             except Exception as e:
-                last_error = LLMError(
-                    f"Unexpected error with provider {provider_name}: {str(e)}",
-                    LLMErrorType.API_ERROR,
-                    False,
-                    provider_name
-                )
-                print(f"Unexpected error with {provider_name}: {str(e)}")
+                last_error = self._record_failure(provider_name, breaker, e)
                 continue
+            except BaseException:
+                # Interrupted or cancelled: no verdict on the provider
+                breaker.release()
+                raise
 
-        # All providers failed
-        if last_error:
-            raise last_error
-        else:
+            self._record_success(provider_name, breaker)
+            self._store_response(cache_config, provider, messages, response)
+            return response
+
+        raise self._chain_failed_error(last_error)
+
+    def generate_stream(self, messages: List[Dict[str, str]],
+                        preferred_provider: Optional[str] = None) -> Iterator[str]:
+        """Stream completion content using provider chain
+
+        Falls back to the next provider only if nothing has been streamed yet.
+        """
+        chain = self._provider_chain(preferred_provider)
+        last_error = None
+
+        for provider_name, provider in chain:
+            breaker = self._get_breaker(provider_name)
+            if not self._admit(provider_name, breaker):
+                last_error = self._circuit_open_error(provider_name)
+                continue
+
+            started = False
+            try:
+                if not provider.is_available():
+                    last_error = self._unavailable_error(provider_name, breaker)
+                    continue
+
+                for chunk in provider.stream_completion(messages):
+                    started = True
+                    yield chunk
+
+            except Exception as e:
+                last_error = self._record_failure(provider_name, breaker, e)
+                if started:
+                    raise
+                continue
+            except GeneratorExit:
+                # The consumer stopped early while the provider was streaming
+                breaker.reset()
+                raise
+            except BaseException:
+                breaker.release()
+                raise
+
+            self._record_success(provider_name, breaker)
+            return
+
+        raise self._chain_failed_error(last_error)
+
+    def _provider_chain(self, preferred_provider: Optional[str]) -> List[Tuple[str, LLMProvider]]:
+        """Get the registered providers to try, in order"""
+        chain = [
+            (name, self.providers[name])
+            for name in self._build_provider_chain(preferred_provider)
+            if name in self.providers
+        ]
+
+        if not chain:
             raise LLMError(
-                "All LLM providers failed",
+                "No LLM providers available",
                 LLMErrorType.PROVIDER_UNAVAILABLE,
                 False
             )
+        return chain
+
+    def _admit(self, provider_name: str, breaker: CircuitBreaker) -> bool:
+        """Check the provider's circuit breaker before trying it"""
+        if not breaker.allow():
+            return False
+        print(f"Trying LLM provider: {provider_name}")
+        return True
+
+    def _unavailable_error(self, provider_name: str, breaker: CircuitBreaker) -> LLMError:
+        """Record a failed availability check"""
+        print(f"Provider {provider_name} is not available, skipping")
+        breaker.record_failure()
+        return LLMError(
+            f"Provider {provider_name} is not available",
+            LLMErrorType.PROVIDER_UNAVAILABLE,
+            True,
+            provider_name
+        )
+
+    def _record_success(self, provider_name: str, breaker: CircuitBreaker) -> None:
+        """Record a successful call"""
+        print(f"Successfully generated completion with {provider_name}")
+        breaker.reset()
+
+    def _record_failure(self, provider_name: str, breaker: CircuitBreaker,
+                        error: Exception) -> LLMError:
+        """Record a failed call and return it as LLMError"""
+        if isinstance(error, LLMError):
+            breaker.record_error(error)
+            print(f"Provider {provider_name} failed: {str(error)}")
+            return error
+
+        breaker.record_failure()
+        print(f"Unexpected error with {provider_name}: {str(error)}")
+        return LLMError(
+            f"Unexpected error with provider {provider_name}: {str(error)}",
+            LLMErrorType.API_ERROR,
+            False,
+            provider_name
+        )
+
+    def _record_background_outcome(self, provider_name: str, breaker: CircuitBreaker,
+                                   future: Future) -> None:
+        """Record the outcome of a hedged request nobody is waiting on"""
+        if future.cancelled():
+            breaker.release()
+            return
+        error = future.exception()
+        if error is None:
+            breaker.reset()
+        elif isinstance(error, Exception):
+            self._record_failure(provider_name, breaker, error)
+        else:
+            breaker.release()
+
+    def _chain_failed_error(self, last_error: Optional[LLMError]) -> LLMError:
+        """Get the error to raise once every provider has failed"""
+        if last_error:
+            return last_error
+        return LLMError(
+            "All LLM providers failed",
+            LLMErrorType.PROVIDER_UNAVAILABLE,
+            False
+        )
+
+    def _request_key(self, messages: List[Dict[str, str]],
+                     preferred_provider: Optional[str]) -> Optional[str]:
+        """Get the key identifying a request for coalescing, or None if it cannot be keyed"""
+        chain = self._build_provider_chain(preferred_provider)
+        config = getattr(self.providers.get(chain[0]), 'config', None) if chain else None
+        if not isinstance(config, ProviderConfig):
+            return None
+        return '|'.join(chain) + ':' + ResponseCache.make_key(config, messages)
+
+    def _get_breaker(self, provider_name: str) -> CircuitBreaker:
+        """Get the circuit breaker for a provider"""
+        breaker = self.breakers.get(provider_name)
+        if breaker is None:
+            breaker = self.breakers.setdefault(
+                provider_name,
+                CircuitBreaker(self.breaker_threshold, self.breaker_cooldown)
+            )
+        return breaker
+
+    def _circuit_open_error(self, provider_name: str) -> LLMError:
+        """Build the error for a provider skipped by its circuit breaker"""
+        print(f"Provider {provider_name} circuit is open, skipping")
+        return LLMError(
+            f"Provider {provider_name} circuit is open",
+            LLMErrorType.PROVIDER_UNAVAILABLE,
+            True,
+            provider_name
+        )
+
+    def _cache_config(self, chain: List[Tuple[str, LLMProvider]]) -> Optional[ProviderConfig]:
+        """Get the config keying cache entries for a chain, or None if caching does not apply"""
+        for _, provider in chain:
+            if self._is_cacheable(provider):
+                return provider.config
+        return None
+
+    def _is_cacheable(self, provider: LLMProvider) -> bool:
+        """Check if responses from this provider may be cached"""
+        config = getattr(provider, 'config', None)
+        return self.cache is not None and isinstance(config, ProviderConfig) and self.cache.is_cacheable(config)
+
+    def _store_response(self, cache_config: Optional[ProviderConfig], provider: LLMProvider,
+                        messages: List[Dict[str, str]], response: Dict[str, Any]) -> None:
+        """Cache a response under the chain's cache key"""
+        # Truncated or filtered completions are not worth replaying
+        if cache_config and self._is_cacheable(provider) and response.get('finish_reason') == 'stop':
+            self.cache.store(cache_config, messages, response)
+
+    def discard_cached(self, messages: List[Dict[str, str]], response: Dict[str, Any],
+                       preferred_provider: Optional[str] = None) -> None:
+        """Drop a cached response the caller could not use"""
+        cache_config = self._cache_config(self._provider_chain(preferred_provider))
+        if cache_config:
+            self.cache.discard(cache_config, messages, response)
+
+    def cache_stats(self) -> Dict[str, int]:
+        """Get response cache statistics"""
+        if self.cache is None:
+            return {'hits': 0, 'misses': 0, 'evictions': 0, 'size': 0}
+        return self.cache.stats()
 
     def _generate_with_retry(self, provider: LLMProvider,
                             messages: List[Dict[str, str]]) -> Dict[str, Any]:
@@ -330,16 +1470,52 @@ class LLMRouter:
             except LLMError as e:
                 last_error = e
 
+                if e.error_type in _AVAILABILITY_ERRORS:
+                    provider.invalidate_availability()
+
                 if not e.retryable:
                     raise e
 
                 if attempt < self.retry_attempts - 1:
-                    delay = self.retry_delay * (2 ** attempt)  # Exponential backoff
-                    print(f"Retrying in {delay}s (attempt {attempt + 1}/{self.retry_attempts})...")
+                    delay = self._retry_delay_for(e, attempt)
+                    print(f"Retrying in {delay:.1f}s (attempt {attempt + 1}/{self.retry_attempts})...")
                     time.sleep(delay)
 
         raise last_error
 
+    async def _agenerate_with_retry(self, provider: LLMProvider,
+                                    messages: List[Dict[str, str]]) -> Dict[str, Any]:
+        """Async variant of _generate_with_retry"""
+        last_error = None
+
+        for attempt in range(self.retry_attempts):
+            try:
+                return await provider.agenerate_completion(messages)
+            except LLMError as e:
+                last_error = e
+
+                if e.error_type in _AVAILABILITY_ERRORS:
+                    provider.invalidate_availability()
+
+                if not e.retryable:
+                    raise e
+
+                if attempt < self.retry_attempts - 1:
+                    delay = self._retry_delay_for(e, attempt)
+                    print(f"Retrying in {delay:.1f}s (attempt {attempt + 1}/{self.retry_attempts})...")
+                    await asyncio.sleep(delay)
+
+        raise last_error
+
+    def _retry_delay_for(self, error: LLMError, attempt: int) -> float:
+        """Get the delay before the next retry"""
+        if error.retry_after is not None:
+            delay = error.retry_after
+        else:
+            # Jittered exponential backoff keeps concurrent workers from retrying in lockstep
+            delay = self.retry_delay * (2 ** attempt) * random.uniform(0.5, 1.5)
+        return min(delay, self.max_retry_delay)
+
     def _build_provider_chain(self, preferred_provider: Optional[str]) -> List[str]:
         """Build provider chain based on preferences"""
         chain = []
@@ -360,38 +1536,210 @@ class LLMRouter:
         """Get list of registered providers"""
         return list(self.providers.keys())
 
+    def close(self) -> None:
+        """Close all registered providers
+
+        Async providers hold aiohttp sessions that need an event loop to
+        shut down; from async code use ``await aclose()`` instead.
+        """
+        for provider in self.providers.values():
+            provider.close()
+
+    async def aclose(self) -> None:
+        """Close all registered providers, including async sessions"""
+        for provider in self.providers.values():
+            await provider.aclose()
+
+
+# Static prompt parts, kept stable so provider-side prefix caches can reuse them
+_CARD_INSTRUCTIONS = 'You are a helpful assistant that creates high-quality flashcards from markdown content. Generate clear, concise questions with accurate answers. Respond ONLY with valid JSON.'
+_CARD_SCHEMA = """Generate flashcards in JSON format (respond ONLY with the JSON array):
+[
+  {
+    "type": "basic",
+    "front": "Question",
+    "back": "Answer",
+    "tags": ["tag1"]
+  }
+]"""
+_BATCH_INSTRUCTIONS = 'You are a helpful assistant that creates high-quality flashcards from markdown content. You receive a JSON array of notes, each with an "id". Generate clear, concise questions with accurate answers for every note. Respond ONLY with valid JSON.'
+_BATCH_SCHEMA = """Respond ONLY with a JSON array containing one entry per note id:
+[
+  {
+    "id": 0,
+    "cards": [
+      {
+        "type": "basic",
+        "front": "Question",
+        "back": "Answer",
+        "tags": ["tag1"]
+      }
+    ]
+  }
+]"""
+
+_CARDS_PROMPT_PREFIX = 'Analyze this markdown content and generate flashcards:\n\n'
+_CARDS_PROMPT_SUFFIX = '\n'
+_BATCH_PROMPT_PREFIX = 'Analyze each markdown note below and generate flashcards for it.\n\nNotes:\n'
+_BATCH_PROMPT_SUFFIX = '\n'
+
+
+def _system_message(parts: Tuple[str, ...], cache_control: bool) -> Dict[str, Any]:
+    """Build a system message from stable prompt parts
+
+    With cache_control each part becomes a text block tagged for
+    ephemeral prefix caching; otherwise the parts are joined.
+    """
+    if cache_control:
+        content: Any = [
+            {'type': 'text', 'text': part, 'cache_control': {'type': 'ephemeral'}}
+            for part in parts
+        ]
+    else:
+        content = '\n\n'.join(parts)
+    return {'role': 'system', 'content': content}
+
+
+_SYSTEM_CARDS = _system_message((_CARD_INSTRUCTIONS, _CARD_SCHEMA), False)
+_SYSTEM_CARDS_CACHED = _system_message((_CARD_INSTRUCTIONS, _CARD_SCHEMA), True)
+_SYSTEM_BATCH = _system_message((_BATCH_INSTRUCTIONS, _BATCH_SCHEMA), False)
+_SYSTEM_BATCH_CACHED = _system_message((_BATCH_INSTRUCTIONS, _BATCH_SCHEMA), True)
+_SYSTEM_ANSWER = {
+    'role': 'system',
+    'content': 'You are a knowledgeable tutor providing clear, accurate answers.'
+}
+
 
 class SmartCardGenerator:
     """Generate flashcards using LLM"""
 
-    def __init__(self, router: LLMRouter):
+    # Keep at or below the provider session pool size so connections are reused
+    MAX_WORKERS = OpenAICompatibleProvider.POOL_MAXSIZE
+
+    def __init__(self, router: LLMRouter, batch_size: int = 8,
+                 cache_control: bool = False):
         self.router = router
+        self.batch_size = batch_size
+        # Mark stable system prompt blocks for provider-side prefix caching
+        self.cache_control = cache_control
+        self._system_cards = _SYSTEM_CARDS_CACHED if cache_control else _SYSTEM_CARDS
+        self._system_batch = _SYSTEM_BATCH_CACHED if cache_control else _SYSTEM_BATCH
 
     def generate_cards(self, content: str, context: Optional[str] = None) -> List[Dict[str, Any]]:
         """Generate flashcards from content"""
-        prompt = self._build_card_generation_prompt(content, context)
+        messages = self._build_card_messages(content, context)
+        return self._parse_response_cards(messages, self.router.generate(messages))
+
+    def generate_cards_stream(self, content: str, context: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        """Generate flashcards from content, yielding each card as soon as it is complete"""
+        chunks = self.router.generate_stream(self._build_card_messages(content, context))
+        yield from _iter_json_objects(chunks)
+
+    def _build_card_messages(self, content: str, context: Optional[str]) -> List[Dict[str, Any]]:
+        """Build messages for card generation"""
+        return [
+            self._system_cards,
+            {'role': 'user', 'content': self._build_card_generation_prompt(content, context)}
+        ]
+
+    def generate_cards_batch(self, contents: List[Tuple[str, Optional[str]]]) -> List[List[Dict[str, Any]]]:
+        """Generate flashcards for several (content, context) pairs concurrently
+
+        Results are returned in the same order as the input.
+        """
+        if not contents:
+            return []
+
+        with ThreadPoolExecutor(max_workers=min(self.MAX_WORKERS, len(contents))) as executor:
+            # Submit everything before collecting so the requests overlap
+            futures = [executor.submit(self.generate_cards, content, context)
+                       for content, context in contents]
+            return [future.result() for future in futures]
+
+    async def agenerate_cards(self, content: str, context: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Async variant of generate_cards"""
+        messages = self._build_card_messages(content, context)
+        return self._parse_response_cards(messages, await self.router.agenerate(messages))
+
+    async def agenerate_cards_batch(self, contents: List[Tuple[str, Optional[str]]]) -> List[List[Dict[str, Any]]]:
+        """Async variant of generate_cards_batch"""
+        return list(await asyncio.gather(*[
+            self.agenerate_cards(content, context)
+            for content, context in contents
+        ]))
+
+    def generate_cards_marshalled(self, items: List[Dict[str, str]],
+                                  batch_size: Optional[int] = None) -> List[List[Dict[str, Any]]]:
+        """Generate flashcards for several notes, packing batch_size notes per request
+
+        Each item is a dict with 'content' and optional 'context'.
+        Results are returned in the same order as the input.
+        """
+        batch_size = max(1, batch_size or self.batch_size)
+        results: List[List[Dict[str, Any]]] = []
+
+        for start in range(0, len(items), batch_size):
+            chunk = list(enumerate(items[start:start + batch_size]))
+            results.extend(self._generate_marshalled_chunk(chunk))
+
+        return results
+
+    def _generate_marshalled_chunk(self, chunk: List[Tuple[int, Dict[str, str]]]) -> List[List[Dict[str, Any]]]:
+        """Generate cards for one packed request, splitting it if output is truncated"""
+        rows = [
+            {'id': i, 'content': item.get('content', ''), 'context': item.get('context')}
+            for i, item in chunk
+        ]
 
         messages = [
-            {
-                'role': 'system',
-                'content': 'You are a helpful assistant that creates high-quality flashcards from markdown content. Generate clear, concise questions with accurate answers. Respond ONLY with valid JSON.'
-            },
-            {
-                'role': 'user',
-                'content': prompt
-            }
+            self._system_batch,
+            {'role': 'user', 'content': self._build_marshalled_prompt(rows)}
         ]
 
         response = self.router.generate(messages)
-        return self._parse_cards(response['content'])
+
+        if response.get('finish_reason') == 'length':
+            if len(chunk) > 1:
+                half = len(chunk) // 2
+                print(f"Warning: LLM output truncated for {len(chunk)} notes, retrying with batch size {half}")
+                return (self._generate_marshalled_chunk(chunk[:half]) +
+                        self._generate_marshalled_chunk(chunk[half:]))
+            print("Warning: LLM output truncated, generated cards may be incomplete")
+
+        by_id: Dict[Any, List[Dict[str, Any]]] = {}
+        for entry in self._parse_response_cards(messages, response):
+            if isinstance(entry, dict) and isinstance(entry.get('cards'), list):
+                by_id[self._note_id(entry.get('id'))] = entry['cards']
+
+        missing = [i for i, _ in chunk if i not in by_id]
+        if missing and response.get('finish_reason') != 'length':
+            if len(missing) == len(chunk):
+                self.router.discard_cached(messages, response)
+                raise LLMError(
+                    f"Failed to parse card response: no cards for note ids {missing}",
+                    LLMErrorType.PARSE_ERROR,
+                    False
+                )
+            print(f"Warning: LLM response has no cards for note ids {missing}")
+
+        return [by_id.get(i, []) for i, _ in chunk]
+
+    @staticmethod
+    def _note_id(value: Any) -> Any:
+        """Normalize a note id echoed by the model (e.g. "0" or 0.0) to an int"""
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return value
+
+    def _build_marshalled_prompt(self, rows: List[Dict[str, Any]]) -> str:
+        """Build prompt for packed multi-note card generation"""
+        return _BATCH_PROMPT_PREFIX + json.dumps(rows, ensure_ascii=False) + _BATCH_PROMPT_SUFFIX
 
     def generate_answer(self, question: str, context: Optional[str] = None) -> str:
         """Generate answer for a question"""
         messages = [
-            {
-                'role': 'system',
-                'content': 'You are a knowledgeable tutor providing clear, accurate answers.'
-            },
+            _SYSTEM_ANSWER,
             {
                 'role': 'user',
                 'content': f"Question: {question}\n\nContext: {context or 'None'}\n\nProvide a comprehensive answer:"
@@ -403,34 +1751,33 @@ class SmartCardGenerator:
 
     def _build_card_generation_prompt(self, content: str, context: Optional[str]) -> str:
         """Build prompt for card generation"""
-        return f"""Analyze this markdown content and generate flashcards:
-
-{content}
+        # Dynamic content goes last so the shared prefix stays cacheable
+        return _CARDS_PROMPT_PREFIX + content + _CARDS_PROMPT_SUFFIX
 
-Generate flashcards in JSON format (respond ONLY with the JSON array):
-[
-  {{
-    "type": "basic",
-    "front": "Question",
-    "back": "Answer",
-    "tags": ["tag1"]
-  }}
-]
-"""
+    def _parse_response_cards(self, messages: List[Dict[str, Any]],
+                              response: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Parse cards from a response, evicting it from the cache if unusable"""
+        try:
+            return self._parse_cards(response['content'])
+        except LLMError:
+            self.router.discard_cached(messages, response)
+            raise
 
     def _parse_cards(self, response: str) -> List[Dict[str, Any]]:
         """Parse card response"""
-        import re
-
         try:
             # Extract JSON from markdown code block if present
-            json_match = re.search(r'```json\s*(.*?)\s*```', response, re.DOTALL)
-            if json_match:
-                json_str = json_match.group(1)
-            else:
-                json_str = response
-
-            cards = json.loads(json_str)
+            json_str = response
+            if '```' in response:
+                json_match = None
+                if '```json' in response:
+                    json_match = _JSON_BLOCK_RE.search(response)
+                if json_match is None:
+                    json_match = _FENCED_BLOCK_RE.search(response)
+                if json_match:
+                    json_str = json_match.group(1)
+
+            cards = _json_loads(json_str)
 
             if not isinstance(cards, list):
                 raise ValueError("Response is not a list")
@@ -445,48 +1792,124 @@ Generate flashcards in JSON format (respond ONLY with the JSON array):
             )
 
 
+def _iter_json_objects(chunks: Iterable[str]) -> Iterator[Dict[str, Any]]:
+    """Yield each top-level JSON object from streamed text as soon as it closes
+
+    Raises PARSE_ERROR if the text ends inside an object or contains no JSON.
+    """
+    buffer: List[str] = []
+    depth = 0
+    in_string = False
+    escaped = False
+    found = False
+
+    for chunk in chunks:
+        for char in chunk:
+            if depth:
+                buffer.append(char)
+
+            if in_string:
+                if escaped:
+                    escaped = False
+                elif char == '\\':
+                    escaped = True
+                elif char == '"':
+                    in_string = False
+            elif char == '"':
+                in_string = depth > 0
+            elif char == '{':
+                if not depth:
+                    buffer = [char]
+                depth += 1
+            elif char == '[' and not depth:
+                # An empty array is a valid answer with no cards
+                found = True
+            elif char == '}' and depth:
+                depth -= 1
+                if not depth:
+                    try:
+                        card = _json_loads(''.join(buffer))
+                    except ValueError as e:
+                        raise LLMError(
+                            f"Failed to parse card response: {str(e)}",
+                            LLMErrorType.PARSE_ERROR,
+                            False
+                        )
+                    found = True
+                    yield card
+
+    if depth:
+        raise LLMError(
+            "Failed to parse card response: output ended inside a card",
+            LLMErrorType.PARSE_ERROR,
+            False
+        )
+    if not found:
+        raise LLMError(
+            "Failed to parse card response: no cards found",
+            LLMErrorType.PARSE_ERROR,
+            False
+        )
+
+
+def _provider_config(config: Dict[str, Any], prefix: str) -> ProviderConfig:
+    """Build the config for the primary or fallback provider"""
+    return ProviderConfig.from_dict({
+        'provider': config[f'{prefix}_provider'],
+        'endpoint': config.get(f'{prefix}_endpoint'),
+        'model': config.get(f'{prefix}_model'),
+        'api_key': config.get(f'{prefix}_api_key'),
+        'temperature': config.get('temperature', 0.7),
+        'max_tokens': config.get('max_tokens', 2000),
+        'timeout': config.get('timeout', 60),
+        'stream': config.get('stream', False),
+        'prompt_cache_key': config.get('prompt_cache_key'),
+        'compress_requests': config.get('compress_requests', False),
+    })
+
+
 def create_llm_system(config: Dict[str, Any]) -> tuple:
     """Create and configure LLM system from config
 
     Returns: (router, card_generator)
     """
-    router = LLMRouter()
+    cache = None
+    if config.get('semantic_cache'):
+        # Only single-note card prompts tolerate near-duplicate matches
+        cache = SemanticResponseCache(
+            threshold=config.get('semantic_cache_threshold', 0.97),
+            max_entries=config.get('cache_size', 1024),
+            system_prompts=(_SYSTEM_CARDS, _SYSTEM_CARDS_CACHED),
+            maxsize=config.get('cache_size', 1024),
+            ttl=config.get('cache_ttl', 3600)
+        )
+    elif config.get('cache_responses'):
+        cache = ResponseCache(
+            maxsize=config.get('cache_size', 1024),
+            ttl=config.get('cache_ttl', 3600)
+        )
+    router = LLMRouter(cache)
+    provider_class = AsyncOpenAICompatibleProvider if config.get('async_http') else OpenAICompatibleProvider
 
     # Configure primary provider
     if config.get('primary_provider'):
-        primary_config = {
-            'provider': config['primary_provider'],
-            'endpoint': config.get('primary_endpoint'),
-            'model': config.get('primary_model'),
-            'api_key': config.get('primary_api_key'),
-            'temperature': config.get('temperature', 0.7),
-            'max_tokens': config.get('max_tokens', 2000),
-            'timeout': config.get('timeout', 60)
-        }
-
-        primary_provider = OpenAICompatibleProvider()
-        primary_provider.initialize(primary_config)
+        primary_provider = provider_class()
+        primary_provider.initialize(_provider_config(config, 'primary'))
         router.register_provider(config['primary_provider'], primary_provider)
         router.set_default_provider(config['primary_provider'])
 
     # Configure fallback provider if specified
     if config.get('fallback_provider'):
-        fallback_config = {
-            'provider': config['fallback_provider'],
-            'endpoint': config.get('fallback_endpoint'),
-            'model': config.get('fallback_model'),
-            'api_key': config.get('fallback_api_key'),
-            'temperature': config.get('temperature', 0.7),
-            'max_tokens': config.get('max_tokens', 2000),
-            'timeout': config.get('timeout', 60)
-        }
-
-        fallback_provider = OpenAICompatibleProvider()
-        fallback_provider.initialize(fallback_config)
+        fallback_provider = provider_class()
+        fallback_provider.initialize(_provider_config(config, 'fallback'))
         router.register_provider(config['fallback_provider'], fallback_provider)
         router.set_fallback_chain([config['fallback_provider']])
 
     # Create card generator
-    card_generator = SmartCardGenerator(router)
+    card_generator = SmartCardGenerator(
+        router,
+        config.get('batch_size', 8),
+        config.get('prompt_cache_control', False)
+    )
 
     return router, card_generator
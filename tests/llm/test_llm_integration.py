@@ -0,0 +1,323 @@
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
+
+import llm_integration as llm  # noqa: E402
+from llm_integration import (  # noqa: E402
+    CircuitBreaker, CircuitState, LLMError, LLMErrorType, LLMRouter,
+    ProviderConfig, ResponseCache, SemanticResponseCache, SmartCardGenerator,
+)
+
+MESSAGES = [{'role': 'user', 'content': 'note'}]
+CARDS = '[{"front": "Q", "back": "A"}]'
+
+
+class StubProvider(llm.LLMProvider):
+    """Provider returning canned responses without any network access"""
+
+    def __init__(self, content=CARDS, finish_reason='stop', delay=0.0,
+                 error=None, temperature=0.0):
+        self.config = ProviderConfig(endpoint='http://stub', model='stub',
+                                     temperature=temperature)
+        self.content = content
+        self.finish_reason = finish_reason
+        self.delay = delay
+        self.error = error
+        self.calls = 0
+
+    def initialize(self, config):
+        pass
+
+    def generate_completion(self, messages):
+        self.calls += 1
+        if self.delay:
+            time.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return {'content': self.content, 'finish_reason': self.finish_reason, 'usage': {}}
+
+    def is_available(self):
+        return True
+
+    def get_name(self):
+        return 'stub'
+
+
+def make_router(cache=None, **providers):
+    router = LLMRouter(cache)
+    router.set_retry_config(1, 0)
+    for name, provider in providers.items():
+        router.register_provider(name, provider)
+    names = list(providers)
+    router.set_default_provider(names[0])
+    router.set_fallback_chain(names[1:])
+    return router
+
+
+@pytest.fixture()
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(llm.time, 'monotonic', lambda: now[0])
+    return now
+
+
+# CircuitBreaker
+
+def test_breaker_opens_after_threshold(clock):
+    breaker = CircuitBreaker(threshold=2, cooldown=10)
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitState.OPEN
+    assert not breaker.allow()
+
+def test_breaker_half_open_trial_after_cooldown(clock):
+    breaker = CircuitBreaker(threshold=1, cooldown=10)
+    breaker.record_failure()
+    clock[0] += 10
+    assert breaker.allow()
+    assert breaker.state == CircuitState.HALF_OPEN
+    assert not breaker.allow()
+    breaker.reset()
+    assert breaker.state == CircuitState.CLOSED
+
+def test_breaker_failed_trial_reopens(clock):
+    breaker = CircuitBreaker(threshold=3, cooldown=10)
+    for _ in range(3):
+        breaker.record_failure()
+    clock[0] += 10
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitState.OPEN
+    assert not breaker.allow()
+
+def test_breaker_stale_trial_is_replaced(clock):
+    breaker = CircuitBreaker(threshold=1, cooldown=10)
+    breaker.record_failure()
+    clock[0] += 10
+    assert breaker.allow()
+    clock[0] += 10
+    assert breaker.allow()
+
+def test_breaker_release_frees_trial(clock):
+    breaker = CircuitBreaker(threshold=1, cooldown=10)
+    breaker.record_failure()
+    clock[0] += 10
+    assert breaker.allow()
+    breaker.release()
+    assert breaker.allow()
+
+def test_breaker_ignores_client_errors():
+    breaker = CircuitBreaker(threshold=1)
+    for error_type in (LLMErrorType.API_ERROR, LLMErrorType.PARSE_ERROR, LLMErrorType.RATE_LIMIT):
+        breaker.record_error(LLMError('client error', error_type, False))
+    assert breaker.state == CircuitState.CLOSED
+
+def test_breaker_trips_on_server_errors():
+    breaker = CircuitBreaker(threshold=1)
+    breaker.record_error(LLMError('server error', LLMErrorType.API_ERROR, True))
+    assert breaker.state == CircuitState.OPEN
+
+def test_router_client_errors_keep_circuit_closed():
+    provider = StubProvider(error=LLMError('400', LLMErrorType.API_ERROR, False))
+    router = make_router(p=provider)
+    router.set_circuit_breaker_config(2, 30)
+    for _ in range(5):
+        with pytest.raises(LLMError):
+            router.generate(MESSAGES)
+    assert provider.calls == 5
+    assert router.breakers['p'].state == CircuitState.CLOSED
+
+
+# ResponseCache
+
+def test_cache_hit_returns_copy():
+    cache = ResponseCache()
+    config = ProviderConfig(endpoint='e', model='m', temperature=0)
+    cache.store(config, MESSAGES, {'content': 'x'})
+    first = cache.lookup(config, MESSAGES)
+    first['content'] = 'mutated'
+    assert cache.lookup(config, MESSAGES) == {'content': 'x'}
+    assert cache.stats()['hits'] == 2
+
+def test_cache_expires_after_ttl(clock):
+    cache = ResponseCache(ttl=5)
+    cache.set('k', {'content': 'x'})
+    clock[0] += 5
+    assert cache.get('k') is None
+    assert cache.stats() == {'hits': 0, 'misses': 1, 'evictions': 1, 'size': 0}
+
+def test_cache_evicts_least_recently_used():
+    cache = ResponseCache(maxsize=2)
+    cache.set('a', {'content': 'a'})
+    cache.set('b', {'content': 'b'})
+    cache.get('a')
+    cache.set('c', {'content': 'c'})
+    assert cache.get('b') is None
+    assert cache.get('a') is not None
+    assert cache.stats()['evictions'] == 1
+
+def test_cache_skips_sampled_configs():
+    cache = ResponseCache(max_temperature=0.3)
+    assert cache.is_cacheable(ProviderConfig(endpoint='e', model='m', temperature=0.3))
+    assert not cache.is_cacheable(ProviderConfig(endpoint='e', model='m', temperature=0.7))
+
+def test_router_counts_one_miss_across_fallback():
+    broken = StubProvider(error=LLMError('down', LLMErrorType.NETWORK_ERROR, False))
+    router = make_router(ResponseCache(), p=broken, f=StubProvider())
+    router.generate(MESSAGES)
+    router.generate(MESSAGES)
+    assert router.cache_stats()['misses'] == 1
+    assert router.cache_stats()['hits'] == 1
+
+def test_router_does_not_cache_truncated_response():
+    provider = StubProvider(finish_reason='length')
+    router = make_router(ResponseCache(), p=provider)
+    router.generate(MESSAGES)
+    router.generate(MESSAGES)
+    assert provider.calls == 2
+    assert router.cache_stats()['size'] == 0
+
+def test_unparseable_cards_are_evicted():
+    provider = StubProvider(content='Sorry, I cannot help')
+    generator = SmartCardGenerator(make_router(ResponseCache(), p=provider))
+    for _ in range(2):
+        with pytest.raises(LLMError):
+            generator.generate_cards('note')
+    assert provider.calls == 2
+
+
+# SemanticResponseCache
+
+def test_semantic_cache_matches_near_duplicates():
+    cache = SemanticResponseCache(embed=lambda text: [1.0, 0.0])
+    config = ProviderConfig(endpoint='e', model='m', temperature=0)
+    cache.store(config, [{'role': 'user', 'content': 'A note'}], {'content': 'x'})
+    assert cache.lookup(config, [{'role': 'user', 'content': 'a  [[note]]'}]) == {'content': 'x'}
+    assert cache.stats()['semantic_hits'] == 1
+
+def test_semantic_cache_keeps_dates():
+    normalize = SemanticResponseCache.normalize
+    assert normalize('Signed on 1648-10-24') != normalize('Signed on 1918-11-11')
+
+def test_semantic_cache_limited_to_system_prompts():
+    calls = []
+    card_prompt = {'role': 'system', 'content': 'cards'}
+    cache = SemanticResponseCache(embed=lambda text: calls.append(text) or [1.0, 0.0],
+                                  system_prompts=[card_prompt])
+    config = ProviderConfig(endpoint='e', model='m', temperature=0)
+    answer = [{'role': 'system', 'content': 'answer'}, {'role': 'user', 'content': 'q1'}]
+    cache.store(config, answer, {'content': 'x'})
+    assert cache.lookup(config, answer[:1] + [{'role': 'user', 'content': 'q2'}]) is None
+    assert calls == []
+
+def test_semantic_cache_embeds_once_per_miss():
+    calls = []
+    cache = SemanticResponseCache(embed=lambda text: calls.append(text) or [float(text == 'first'), 1.0 - (text == 'first')])
+    config = ProviderConfig(endpoint='e', model='m', temperature=0)
+    cache.store(config, [{'role': 'user', 'content': 'first'}], {'content': 'x'})
+    messages = [{'role': 'user', 'content': 'second note'}]
+    assert cache.lookup(config, messages) is None
+    cache.store(config, messages, {'content': 'y'})
+    assert calls == ['first', 'second note']
+
+
+# Coalescing and hedging
+
+def test_generate_coalesces_identical_requests():
+    provider = StubProvider(delay=0.2)
+    router = make_router(p=provider)
+    results = [None] * 3
+
+    def run(i):
+        results[i] = router.generate(MESSAGES)
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert provider.calls == 1
+    assert results[0] == results[1] == results[2]
+    assert results[0] is not results[1] and results[1] is not results[2]
+
+def test_hedged_falls_back_after_delay():
+    slow = StubProvider(content='slow', delay=0.5)
+    fast = StubProvider(content='fast')
+    router = make_router(p=slow, f=fast)
+    assert router.generate_hedged(MESSAGES, delay_ms=50)['content'] == 'fast'
+
+def test_hedged_loser_reports_to_breaker():
+    slow = StubProvider(delay=0.3, error=LLMError('down', LLMErrorType.NETWORK_ERROR, True))
+    router = make_router(p=slow, f=StubProvider())
+    router.set_circuit_breaker_config(1, 30)
+    router.generate_hedged(MESSAGES, delay_ms=50)
+    time.sleep(0.5)
+    assert router.breakers['p'].state == CircuitState.OPEN
+
+def test_stream_closed_early_closes_half_open_circuit(clock):
+    class StreamProvider(StubProvider):
+        def stream_completion(self, messages):
+            yield 'a'
+            yield 'b'
+
+    router = make_router(p=StreamProvider())
+    router.set_circuit_breaker_config(1, 10)
+    breaker = router._get_breaker('p')
+    breaker.record_failure()
+    clock[0] += 10
+    stream = router.generate_stream(MESSAGES)
+    assert next(stream) == 'a'
+    stream.close()
+    assert breaker.state == CircuitState.CLOSED
+
+
+# Card parsing
+
+def test_iter_json_objects_yields_as_objects_close():
+    chunks = ['[{"front": "a}"', ', "back": "b"},', ' {"front": "c"}]']
+    assert list(llm._iter_json_objects(chunks)) == [
+        {'front': 'a}', 'back': 'b'},
+        {'front': 'c'},
+    ]
+
+def test_iter_json_objects_accepts_empty_array():
+    assert list(llm._iter_json_objects(['[', ']'])) == []
+
+@pytest.mark.parametrize('chunks', [['[{"front": "a"}, {"front": '], ['Sorry, I cannot help']])
+def test_iter_json_objects_rejects_incomplete_output(chunks):
+    with pytest.raises(LLMError) as info:
+        list(llm._iter_json_objects(chunks))
+    assert info.value.error_type == LLMErrorType.PARSE_ERROR
+
+@pytest.mark.parametrize('content', [
+    CARDS,
+    '```json\n' + CARDS + '\n```',
+    '```JSON\n' + CARDS + '\n```',
+    '```javascript ' + CARDS + '```',
+    '```' + CARDS + '```',
+])
+def test_parse_cards_fences(content):
+    generator = SmartCardGenerator(make_router(p=StubProvider()))
+    assert generator._parse_cards(content) == [{'front': 'Q', 'back': 'A'}]
+
+def test_marshalled_ids_are_normalized():
+    content = '[{"id": "0", "cards": [{"front": "a"}]}, {"id": 1.0, "cards": [{"front": "b"}]}]'
+    generator = SmartCardGenerator(make_router(p=StubProvider(content=content)))
+    assert generator.generate_cards_marshalled([{'content': 'x'}, {'content': 'y'}]) == [
+        [{'front': 'a'}],
+        [{'front': 'b'}],
+    ]
+
+def test_marshalled_response_without_requested_ids_fails():
+    content = '[{"id": "other", "cards": []}]'
+    generator = SmartCardGenerator(make_router(p=StubProvider(content=content)))
+    with pytest.raises(LLMError) as info:
+        generator.generate_cards_marshalled([{'content': 'x'}])
+    assert info.value.error_type == LLMErrorType.PARSE_ERROR